@@ -3,16 +3,38 @@
 LocalFlix Backend - Main Flask Application
 """
 import os
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from flask import Flask, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider that serializes with orjson (C, much faster than the stdlib json module)."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 def create_app(test_config=None):
     """Create and configure the Flask application."""
     # Create and configure the app
     app = Flask(__name__, instance_relative_config=True)
     
+    # Use orjson for jsonify() and request parsing when it is installed
+    if ORJSON_AVAILABLE:
+        app.json = OrjsonProvider(app)
+    
     # Enable CORS for frontend
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     
@@ -25,6 +47,9 @@ def create_app(test_config=None):
     else:
         app.config.from_mapping(test_config)
     
+    # Instance config may override the extensions with a plain set or list
+    app.config['ALLOWED_EXTENSIONS'] = frozenset(app.config['ALLOWED_EXTENSIONS'])
+    
     # Ensure the instance folder exists
     try:
         os.makedirs(app.instance_path, exist_ok=True)
@@ -38,15 +63,45 @@ def create_app(test_config=None):
         pass
     
     # Configure logging
-    handler = RotatingFileHandler('logs/localflix.log', maxBytes=10485760, backupCount=5)
-    handler.setFormatter(logging.Formatter(
+    file_handler = RotatingFileHandler('logs/localflix.log', maxBytes=10485760, backupCount=5)
+    file_handler.setFormatter(logging.Formatter(
         '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
     ))
-    handler.setLevel(logging.INFO)
-    app.logger.addHandler(handler)
+    file_handler.setLevel(logging.INFO)
+    
+    # Write log records from a background thread so requests never block on
+    # disk I/O or log rotation
+    queue_handler = QueueHandler(queue.Queue(-1))
+    
+    def start_log_listener():
+        listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+        listener.start()
+        app.extensions['log_listener'] = listener
+        atexit.register(listener.stop)
+    
+    def restart_log_listener():
+        # The listener thread doesn't survive a fork (e.g. gunicorn --preload workers),
+        # so the child gets a fresh queue and its own listener instead of filling a
+        # queue nothing reads
+        queue_handler.queue = queue.Queue(-1)
+        start_log_listener()
+    
+    start_log_listener()
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=restart_log_listener)
+    
+    app.logger.addHandler(queue_handler)
     app.logger.setLevel(logging.INFO)
     app.logger.info('LocalFlix backend starting up')
     
+    # Load the persisted video catalog so the first request doesn't wait for a full scan
+    from utils.file_scanner import init_cache_file, set_scan_workers
+    set_scan_workers(app.config['SCAN_WORKERS'])
+    init_cache_file(
+        os.path.join(app.instance_path, 'video_cache.sqlite'),
+        app.config['VIDEO_DIRECTORY']
+    )
+    
     # Register routes
     from routes.api import api_bp
     from routes.stream import stream_bp
@@ -61,6 +116,29 @@ def create_app(test_config=None):
     
     return app
 
+def start_background_tasks(app):
+    """
+    Start the background scanner, file watcher and thumbnail workers if
+    BACKGROUND_SCAN is enabled. Without them, requests rescan the catalog
+    themselves once it goes stale.
+    
+    The threads belong to the process that starts them and don't survive a fork,
+    so this has to run in the one process that serves requests. Under gunicorn,
+    run a single worker and start them from a post_fork hook in gunicorn.conf.py:
+    
+        def post_fork(server, worker):
+            from app import app, start_background_tasks
+            start_background_tasks(app)
+    
+    With several workers, leave BACKGROUND_SCAN off.
+    
+    Args:
+        app (Flask): The application to run the background tasks for
+    """
+    if app.config['BACKGROUND_SCAN'] and not app.config.get('TESTING'):
+        from utils.scanner_thread import start_scanner
+        start_scanner(app)
+
 app = create_app()
 
 if __name__ == '__main__':
@@ -69,4 +147,9 @@ if __name__ == '__main__':
     port = app.config.get('PORT', 5000)
     debug = app.config.get('DEBUG', False)
     
+    # In debug mode the reloader runs this module in a watcher process and again
+    # in the child that serves requests, which is the one that sets WERKZEUG_RUN_MAIN
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks(app)
+    
     app.run(host=host, port=port, debug=debug)
@@ -14,16 +14,25 @@ class Config:
     DEBUG = os.environ.get('DEBUG', 'False').lower() in ('true', '1', 't')
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = int(os.environ.get('PORT', 5000))
+    # Serve files via X-Sendfile (e.g. Apache mod_xsendfile) instead of from Python
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'False').lower() in ('true', '1', 't')
     
     # LocalFlix specific settings
     VIDEO_DIRECTORY = os.environ.get('VIDEO_DIRECTORY', '/home/pi/videos')
-    ALLOWED_EXTENSIONS = {'mp4', 'mkv'}
+    ALLOWED_EXTENSIONS = frozenset({'mp4', 'mkv'})
     THUMBNAIL_DIRECTORY = os.environ.get('THUMBNAIL_DIRECTORY', '/home/pi/localflix/thumbnails')
     GENERATE_THUMBNAILS = os.environ.get('GENERATE_THUMBNAILS', 'True').lower() in ('true', '1', 't')
     THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 320))
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
     
     # API settings
     API_VERSION = '1.0'
     
     # Caching settings
+    CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', 3600))  # Browser cache lifetime for videos and thumbnails
     SCAN_INTERVAL = int(os.environ.get('SCAN_INTERVAL', 3600))  # Default: rescan every hour
+    SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', 32))  # Threads used to stat files during a scan
+    # Background scanner, file watcher and thumbnail workers, started by app.py when
+    # run directly. Only one process should run them, see start_background_tasks
+    BACKGROUND_SCAN = os.environ.get('BACKGROUND_SCAN', 'False').lower() in ('true', '1', 't')
+    WATCH_VIDEO_DIRECTORY = os.environ.get('WATCH_VIDEO_DIRECTORY', 'True').lower() in ('true', '1', 't')
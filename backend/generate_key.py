@@ -1,5 +1,7 @@
 import secrets
 import os
+import re
+import tempfile
 
 def generate_secret_key(length=32):
     """Generates a secure random secret key."""
@@ -8,38 +10,44 @@ def generate_secret_key(length=32):
 def update_flask_settings(filepath=".env"):
     """Updates the SECRET_KEY in a Flask settings file (e.g., .env)."""
     new_secret_key = generate_secret_key()
-    updated_lines = []
-    key_found = False
+    key_line = f"SECRET_KEY={new_secret_key}"
 
     try:
         with open(filepath, 'r') as f:
-            for line in f:
-                if line.startswith("SECRET_KEY="):
-                    updated_lines.append(f"SECRET_KEY={new_secret_key}\n")
-                    key_found = True
-                else:
-                    updated_lines.append(line)
-
-        with open(filepath, 'w') as f:
-            f.writelines(updated_lines)
-
-        if not key_found:
-            with open(filepath, 'a') as f:
-                f.write(f"SECRET_KEY={new_secret_key}\n")
-            print(f"SECRET_KEY added to {filepath}")
-        else:
-            print(f"SECRET_KEY updated in {filepath}")
-
-        print(f"Generated Secret Key: {new_secret_key}")
-
+            data = f.read()
+        mode = os.stat(filepath).st_mode
     except FileNotFoundError:
-        with open(filepath, 'w') as f:
-            f.write(f"SECRET_KEY={new_secret_key}\n")
-            f.write("DEBUG=True\n")
-            f.write("HOST=0.0.0.0\n")
-            f.write("PORT=5000\n")
-        print(f"{filepath} created with a new SECRET_KEY and default settings.")
-        print(f"Generated Secret Key: {new_secret_key}")
+        data = None
+        mode = None
+
+    if data is None:
+        data = f"{key_line}\nDEBUG=True\nHOST=0.0.0.0\nPORT=5000\n"
+        message = f"{filepath} created with a new SECRET_KEY and default settings."
+    else:
+        data, count = re.subn(r'(?m)^SECRET_KEY=.*$', lambda m: key_line, data)
+        if count:
+            message = f"SECRET_KEY updated in {filepath}"
+        else:
+            if data and not data.endswith('\n'):
+                data += '\n'
+            data += f"{key_line}\n"
+            message = f"SECRET_KEY added to {filepath}"
+
+    # Write a temporary file and swap it in, so a crash can't leave a half-written file.
+    # mkstemp creates it readable by the owner only, so the key is never exposed
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), suffix='.tmp')
+    try:
+        if mode is not None:
+            os.fchmod(fd, mode & 0o7777)
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    print(message)
+    print(f"Generated Secret Key: {new_secret_key}")
 
 if __name__ == "__main__":
     update_flask_settings()
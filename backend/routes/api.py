@@ -1,8 +1,9 @@
 """
 API routes for video listings and metadata.
 """
-from flask import Blueprint, jsonify, current_app, request
-from utils.file_scanner import get_video_list, get_video_details
+from itertools import islice
+from flask import Blueprint, jsonify, current_app, request, Response
+from utils.file_scanner import get_video_list, get_video_details, get_library_stats
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
@@ -15,13 +16,14 @@ def get_videos():
     - sort: Sort by 'name', 'date', 'size' (default: 'name')
     - order: 'asc' or 'desc' (default: 'asc')
     """
+    config = current_app.config
     sort_by = request.args.get('sort', 'name')
     order = request.args.get('order', 'asc')
     
     try:
         videos = get_video_list(
-            video_dir=current_app.config['VIDEO_DIRECTORY'],
-            allowed_extensions=current_app.config['ALLOWED_EXTENSIONS'],
+            video_dir=config['VIDEO_DIRECTORY'],
+            allowed_extensions=config['ALLOWED_EXTENSIONS'],
             sort_by=sort_by,
             order=order
         )
@@ -30,14 +32,57 @@ def get_videos():
         current_app.logger.error(f"Error getting video list: {str(e)}")
         return jsonify({'error': 'Failed to get video list'}), 500
 
+@api_bp.route('/videos.ndjson', methods=['GET'])
+def stream_videos():
+    """
+    Stream the video list as newline-delimited JSON, one video per line.
+    
+    Clients can start processing before the whole library is serialized,
+    and the response is never buffered in memory as a whole.
+    
+    Query parameters:
+    - sort: Sort by 'name', 'date', 'size' (default: 'name')
+    - order: 'asc' or 'desc' (default: 'asc')
+    - offset: Number of videos to skip (default: 0)
+    - limit: Maximum number of videos to return (default: all)
+    """
+    config = current_app.config
+    sort_by = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', None, type=int)
+    
+    try:
+        videos = get_video_list(
+            video_dir=config['VIDEO_DIRECTORY'],
+            allowed_extensions=config['ALLOWED_EXTENSIONS'],
+            sort_by=sort_by,
+            order=order
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error getting video list: {str(e)}")
+        return jsonify({'error': 'Failed to get video list'}), 500
+    
+    # The generator runs after the app context is gone, so bind the serializer now
+    dumps = current_app.json.dumps
+    stop = offset + max(limit, 0) if limit is not None else None
+    
+    def generate():
+        for video in islice(videos, offset, stop):
+            yield dumps(video) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @api_bp.route('/videos/<string:video_id>', methods=['GET'])
 def get_video(video_id):
     """Get details for a specific video by ID."""
+    config = current_app.config
+    
     try:
         video = get_video_details(
             video_id=video_id,
-            video_dir=current_app.config['VIDEO_DIRECTORY'],
-            allowed_extensions=current_app.config['ALLOWED_EXTENSIONS']
+            video_dir=config['VIDEO_DIRECTORY'],
+            allowed_extensions=config['ALLOWED_EXTENSIONS']
         )
         
         if video:
@@ -51,25 +96,18 @@ def get_video(video_id):
 @api_bp.route('/stats', methods=['GET'])
 def get_stats():
     """Get statistics about the video library."""
+    config = current_app.config
+    
     try:
-        videos = get_video_list(
-            video_dir=current_app.config['VIDEO_DIRECTORY'],
-            allowed_extensions=current_app.config['ALLOWED_EXTENSIONS']
+        # Counts are kept up to date at scan time, no need to walk the list here
+        stats = get_library_stats(
+            video_dir=config['VIDEO_DIRECTORY'],
+            allowed_extensions=config['ALLOWED_EXTENSIONS']
         )
         
-        # Calculate basic stats
-        total_videos = len(videos)
-        formats = {}
-        for video in videos:
-            ext = video.get('format', 'unknown')
-            formats[ext] = formats.get(ext, 0) + 1
-        
         # You can add more stats here as needed
         
-        return jsonify({
-            'total_videos': total_videos,
-            'formats': formats
-        })
+        return jsonify(stats)
     except Exception as e:
         current_app.logger.error(f"Error getting library stats: {str(e)}")
         return jsonify({'error': 'Failed to get library statistics'}), 500
@@ -1,24 +1,98 @@
 """
 Routes for video streaming and related functionalities.
+
+Byte ranges that run to the end of the file (the usual "bytes=N-" request a
+player sends when seeking) are served by handing an open, seeked file to the
+WSGI server's wsgi.file_wrapper, which gunicorn can send with sendfile(2)
+without the data passing through Python. Closed ranges are streamed from
+Python, since PEP 3333 only says servers *should* stop at Content-Length and
+some keep reading the wrapper to the end of the file. uWSGI is never given the
+wrapper, because its sendfile path may not start at the file's current offset.
 """
 import os
-import re
 from pathlib import Path
 from flask import Blueprint, send_file, abort, current_app, request, Response
+from werkzeug.http import parse_range_header
 
 stream_bp = Blueprint('stream', __name__, url_prefix='/stream')
 
-def get_range_header(range_header, file_size):
-    """Parse the Range header and return start and end positions."""
-    m = re.match(r'bytes=(?P<start>\d+)-(?P<end>\d*)', range_header)
-    if not m:
-        return 0, file_size - 1
+# Chunk size used when a byte range has to be streamed from Python
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+def _iter_file_range(video_file, length):
+    """Yield length bytes from an already positioned file, then close it."""
+    with video_file:
+        while length > 0:
+            data = video_file.read(min(length, STREAM_CHUNK_SIZE))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+def file_etag(stats):
+    """Build a strong ETag for a file from its size and modification time."""
+    return f"{stats.st_size:x}-{stats.st_mtime_ns:x}"
+
+def send_file_range(video_path, mimetype, start, stop, file_size):
+    """
+    Build a 206 response for the bytes [start, stop) of a file.
     
-    start = int(m.group('start'))
-    end = m.group('end')
-    end = int(end) if end else file_size - 1
+    werkzeug wraps ranged send_file responses in its own iterator, which hides
+    the file object from the WSGI server. Returning the server's file wrapper
+    directly keeps the zero-copy sendfile(2) path available for seeking.
+    """
+    length = stop - start
+    video_file = open(video_path, 'rb')
+    video_file.seek(start)
     
-    return start, min(end, file_size - 1)
+    # The wrapper is only safe when the range ends at EOF: a server that ignores
+    # Content-Length would otherwise read (and discard) the rest of the file
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and stop == file_size and 'uwsgi.version' not in request.environ:
+        body = file_wrapper(video_file, STREAM_CHUNK_SIZE)
+    else:
+        body = _iter_file_range(video_file, length)
+    
+    response = Response(body, 206, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{file_size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.content_length = length
+    return response
+
+def _single_range(file_size):
+    """
+    Reduce the request's Range header to a single range, if possible.
+    
+    werkzeug answers multi-range requests with 416 and rejects the whole header
+    when the ranges aren't in ascending, non-overlapping order. RFC 7233 allows
+    serving only one of the requested ranges, so each range is parsed on its own
+    and the first satisfiable one is kept. If none is satisfiable, the first
+    valid one is kept so the response is still a 416. A header without any valid
+    byte range is ignored. The environ is updated too, since send_file parses the
+    header itself.
+    """
+    environ = request.environ
+    header = environ.get('HTTP_RANGE')
+    if header is None:
+        return None
+    
+    units, _, ranges = header.partition('=')
+    video_range = None
+    if units.strip().lower() == 'bytes':
+        for spec in ranges.split(','):
+            candidate = parse_range_header(f'bytes={spec}')
+            if candidate is None:
+                continue
+            if candidate.range_for_length(file_size) is not None:
+                video_range = candidate
+                break
+            video_range = video_range or candidate
+    
+    if video_range is None:
+        del environ['HTTP_RANGE']
+    else:
+        environ['HTTP_RANGE'] = video_range.to_header()
+    return video_range
 
 @stream_bp.route('/<string:video_id>', methods=['GET'])
 def stream_video(video_id):
@@ -26,19 +100,14 @@ def stream_video(video_id):
     Stream a video file with support for range requests (partial content).
     This enables seeking in the video player.
     """
-    from utils.file_scanner import get_video_list
-    
-    video_dir = current_app.config['VIDEO_DIRECTORY']
-    allowed_extensions = current_app.config['ALLOWED_EXTENSIONS']
+    from utils.file_scanner import get_video_by_id
     
-    # Get the video list and find the one with matching ID
-    videos = get_video_list(video_dir, allowed_extensions)
-    video_info = None
+    config = current_app.config
+    video_dir = config['VIDEO_DIRECTORY']
+    allowed_extensions = config['ALLOWED_EXTENSIONS']
     
-    for video in videos:
-        if video['id'] == video_id:
-            video_info = video
-            break
+    # Look up the video with matching ID in the catalog index
+    video_info = get_video_by_id(video_id, video_dir, allowed_extensions)
     
     if not video_info:
         current_app.logger.error(f"Video not found in catalog for ID: {video_id}")
@@ -51,59 +120,63 @@ def stream_video(video_id):
         current_app.logger.error(f"Video file not found at path: {video_path}")
         abort(404)
     
-    file_size = os.path.getsize(video_path)
-    range_header = request.headers.get('Range')
+    mimetype = f'video/{Path(video_path).suffix[1:].lower()}'
+    max_age = config.get('CACHE_MAX_AGE', 3600)
     
-    # Handle range requests for video seeking
-    if range_header:
-        start, end = get_range_header(range_header, file_size)
-        
-        # Calculate the content length
-        content_length = end - start + 1
-        
-        # Create a partial response
-        def generate():
-            with open(video_path, 'rb') as video_file:
-                video_file.seek(start)
-                data = video_file.read(min(content_length, 1024 * 1024))  # Read 1MB at a time
-                while data:
-                    yield data
-                    content_length -= len(data)
-                    if content_length <= 0:
-                        break
-                    data = video_file.read(min(content_length, 1024 * 1024))
-        
-        response = Response(generate(), 206, mimetype=f'video/{Path(video_path).suffix[1:]}',
-                          content_type=f'video/{Path(video_path).suffix[1:]}')
-        response.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
-        response.headers.add('Accept-Ranges', 'bytes')
-        response.headers.add('Content-Length', str(content_length))
-        return response
-    
-    # Return the full file if no range header
-    return send_file(video_path)
+    # Both response paths below must agree on the validators, or If-Range
+    # requests would never match
+    stats = os.stat(video_path)
+    etag = file_etag(stats)
+    
+    # Plain single-range requests (what video players send when seeking) get a
+    # response the WSGI server can pass to sendfile(2)
+    video_range = _single_range(stats.st_size)
+    if (video_range is not None
+            and not config.get('USE_X_SENDFILE')
+            and not any(h in request.headers for h in ('If-Range', 'If-None-Match', 'If-Modified-Since'))):
+        byte_range = video_range.range_for_length(stats.st_size)
+        if byte_range is not None:
+            response = send_file_range(video_path, mimetype, byte_range[0], byte_range[1], stats.st_size)
+            response.set_etag(etag)
+            response.last_modified = stats.st_mtime
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            return response
+    
+    # Let werkzeug handle everything else (full file, multiple or unsatisfiable
+    # ranges, If-* headers incl. 304 responses) and hand the file object to the WSGI server
+    return send_file(
+        video_path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=etag,
+        last_modified=stats.st_mtime,
+        max_age=max_age
+    )
 
 @stream_bp.route('/thumbnail/<string:video_id>', methods=['GET'])
 def get_thumbnail(video_id):
     """Get a thumbnail for a video."""
-    thumbnail_dir = current_app.config['THUMBNAIL_DIRECTORY']
+    config = current_app.config
+    thumbnail_dir = config['THUMBNAIL_DIRECTORY']
+    max_age = config.get('CACHE_MAX_AGE', 3600)
     
     # Look for existing thumbnail
     thumbnail_path = os.path.join(thumbnail_dir, f"{video_id}.jpg")
     
     if os.path.isfile(thumbnail_path):
-        return send_file(thumbnail_path)
+        return send_file(thumbnail_path, max_age=max_age)
     else:
         # Try to generate a thumbnail on-demand if ffmpeg is available
         try:
             from utils.file_scanner import get_video_details
             from utils.video_helper import generate_thumbnail, check_dependencies
             
-            video_dir = current_app.config['VIDEO_DIRECTORY']
-            allowed_extensions = current_app.config['ALLOWED_EXTENSIONS']
+            video_dir = config['VIDEO_DIRECTORY']
+            allowed_extensions = config['ALLOWED_EXTENSIONS']
             
             # Only attempt to generate if config allows it
-            if current_app.config.get('GENERATE_THUMBNAILS', True) and check_dependencies():
+            if config.get('GENERATE_THUMBNAILS', True) and check_dependencies():
                 # Get video details to find the path
                 video = get_video_details(video_id, video_dir, allowed_extensions)
                 
@@ -116,13 +189,14 @@ def get_thumbnail(video_id):
                         video_path, 
                         thumbnail_path, 
                         time_offset=10, 
-                        width=current_app.config.get('THUMBNAIL_WIDTH', 320)
+                        width=config.get('THUMBNAIL_WIDTH', 320)
                     ):
-                        return send_file(thumbnail_path)
+                        return send_file(thumbnail_path, max_age=max_age)
         except Exception as e:
             current_app.logger.error(f"Error generating thumbnail: {str(e)}")
         
-        # Return a default thumbnail if no specific one exists or generation failed
+        # Return a default thumbnail if no specific one exists or generation failed.
+        # It is revalidated on every request, so the real thumbnail shows up once generated
         default_thumbnail = os.path.join(current_app.root_path, 'static', 'default-thumbnail.jpg')
         if os.path.isfile(default_thumbnail):
             return send_file(default_thumbnail)
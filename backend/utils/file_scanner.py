@@ -2,17 +2,116 @@
 Utilities for scanning the filesystem for video files.
 """
 import os
+import json
 import time
+import sqlite3
 import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 # Cache for video listings to avoid excessive file system operations
 _video_cache = {
     'last_scan': 0,
-    'videos': []
+    'videos': [],
+    'by_id': {},
+    'sorted': {},
+    'stats': {'total_videos': 0, 'formats': {}}
 }
 
+# Sort keys for the precomputed catalog orderings
+_SORT_KEYS = {
+    'name': lambda x: x['name'].lower(),
+    'date': lambda x: x['modified'],
+    'size': lambda x: x['size']
+}
+
+# Optional on-disk copy of the cache so restarts don't need a full rescan
+_CACHE_FILE = None
+
+# Bump whenever the format of cached entries (e.g. the video ID scheme) changes
+_CACHE_VERSION = '2'
+
+# Serializes scans between request threads and the background scanner
+_scan_lock = threading.Lock()
+
+# When a background scanner keeps the cache fresh, requests never rescan an already built cache
+_background_scan = False
+
+# Number of threads used to stat files during a scan (stat is latency bound on network mounts)
+_scan_workers = 32
+
+def _connect_cache():
+    """Open the persistent cache database, creating the tables if needed."""
+    conn = sqlite3.connect(_CACHE_FILE)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS videos ('
+        'id TEXT PRIMARY KEY, path TEXT, mtime REAL, size INTEGER, json TEXT)'
+    )
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    return conn
+
+def _set_cache(videos):
+    """Replace the cached catalog and rebuild its ID index, sorted views and stats."""
+    # Build everything before publishing; requests read the cache without a lock
+    by_id = {video['id']: video for video in videos}
+    sorted_views = {key: sorted(videos, key=func) for key, func in _SORT_KEYS.items()}
+    stats = {
+        'total_videos': len(videos),
+        'formats': dict(Counter(video.get('format', 'unknown') for video in videos))
+    }
+    
+    _video_cache['by_id'] = by_id
+    _video_cache['sorted'] = sorted_views
+    _video_cache['stats'] = stats
+    # Published last, so a reader that sees the new catalog also sees its derived views
+    _video_cache['videos'] = videos
+
+def _cache_matches(meta, video_dir):
+    """Check whether stored entries were produced for this video directory and cache format."""
+    return meta.get('video_dir') == video_dir and meta.get('version') == _CACHE_VERSION
+
+def init_cache_file(cache_file, video_dir):
+    """
+    Enable the persistent video cache and load any previous scan from it.
+    
+    Args:
+        cache_file (str): Path to the SQLite file used to store the cache
+        video_dir (str): The directory the cached entries must belong to
+    """
+    global _CACHE_FILE
+    _CACHE_FILE = cache_file
+    
+    try:
+        conn = _connect_cache()
+        try:
+            meta = dict(conn.execute('SELECT key, value FROM meta'))
+            videos = [json.loads(row[0]) for row in conn.execute('SELECT json FROM videos')]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        _CACHE_FILE = None
+        return
+    
+    # Entries from a different video directory or cache format are useless, let the next scan replace them
+    if not _cache_matches(meta, video_dir):
+        return
+    
+    _set_cache(videos)
+    _video_cache['last_scan'] = float(meta.get('last_scan', 0))
+
+def set_background_scan(enabled):
+    """Tell the scanner whether a background thread is responsible for refreshing the cache."""
+    global _background_scan
+    _background_scan = enabled
+
+def set_scan_workers(workers):
+    """Set the number of threads used to stat files during a scan."""
+    global _scan_workers
+    _scan_workers = max(1, int(workers))
+
 def should_rescan(scan_interval):
     """Determine if a rescan is needed based on the last scan time."""
     current_time = time.time()
@@ -20,8 +119,183 @@ def should_rescan(scan_interval):
 
 def generate_video_id(file_path):
     """Generate a unique ID for a video file based on its path."""
-    # We use a hash of the file path to create a unique, URL-friendly ID
-    return hashlib.md5(file_path.encode('utf-8')).hexdigest()
+    # We use a hash of the file path to create a unique, URL-friendly ID.
+    # It doesn't need to be cryptographically strong, BLAKE2b is just cheaper than MD5
+    return hashlib.blake2b(file_path.encode('utf-8'), digest_size=16).hexdigest()
+
+def _scan_files(directory):
+    """Recursively yield os.DirEntry objects for all files under a directory (like os.walk, without following directory symlinks)."""
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file():
+                yield entry
+
+def _stat_entry(entry):
+    """Stat a directory entry, returning None if the file disappeared in the meantime."""
+    try:
+        return entry.path, entry.stat()
+    except OSError:
+        return None
+
+def _build_video_info(file_path, video_dir, stats):
+    """Build the catalog entry for a single video file."""
+    name, ext = os.path.splitext(os.path.basename(file_path))
+    
+    return {
+        'id': generate_video_id(file_path),
+        'name': name,
+        'path': os.path.relpath(file_path, video_dir),
+        'format': ext[1:].lower(),
+        'size': stats.st_size,
+        'size_human': format_file_size(stats.st_size),
+        'modified': datetime.fromtimestamp(stats.st_mtime).isoformat(),
+        'created': datetime.fromtimestamp(stats.st_ctime).isoformat()
+    }
+
+def _needs_scan(force_rescan, scan_interval):
+    """Determine if the cache has to be rebuilt before it can be served."""
+    # last_scan is set only after a scan (or cache load) has published its results, so an
+    # empty library or missing directory doesn't make every request scan again
+    if force_rescan or not _video_cache['last_scan']:
+        return True
+    return not _background_scan and should_rescan(scan_interval)
+
+def _ensure_cache(video_dir, allowed_extensions, force_rescan=False, scan_interval=3600):
+    """Scan the video directory and rebuild the cache if it is stale or was never built."""
+    # Check if we need to rescan
+    if not _needs_scan(force_rescan, scan_interval):
+        return
+    
+    with _scan_lock:
+        # Another thread may have finished a scan while we were waiting
+        if not _needs_scan(force_rescan, scan_interval):
+            return
+        
+        videos = []
+        
+        # Validators from the previous scan, so unchanged files can be reused as-is
+        conn = None
+        known = {}
+        changed = []
+        if _CACHE_FILE:
+            try:
+                conn = _connect_cache()
+                known = {row[0]: row[1:] for row in conn.execute('SELECT path, id, mtime, size, json FROM videos')}
+                
+                # Relative paths and IDs in the stored entries only hold for the same directory and format
+                if not _cache_matches(dict(conn.execute('SELECT key, value FROM meta')), video_dir):
+                    conn.execute('DELETE FROM videos')
+                    known = {}
+            except sqlite3.Error:
+                conn = None
+        
+        # Walk through all files in the video directory, comparing extensions with the dot included
+        dotted_extensions = {f'.{ext}' for ext in allowed_extensions}
+        candidates = [
+            entry for entry in _scan_files(video_dir)
+            if os.path.splitext(entry.name)[1].lower() in dotted_extensions
+        ]
+        
+        # Get file stats concurrently, the GIL is released while waiting on the filesystem
+        if _scan_workers > 1 and len(candidates) > 1:
+            with ThreadPoolExecutor(max_workers=_scan_workers) as pool:
+                stat_results = list(pool.map(_stat_entry, candidates))
+        else:
+            stat_results = [_stat_entry(entry) for entry in candidates]
+        
+        for result in stat_results:
+            if result is None:
+                continue
+            file_path, stats = result
+            
+            cached = known.pop(file_path, None)
+            if cached and cached[1] == stats.st_mtime and cached[2] == stats.st_size:
+                # Unchanged since the last scan, prefer the already parsed entry
+                video_info = _video_cache['by_id'].get(cached[0]) or json.loads(cached[3])
+            else:
+                video_info = _build_video_info(file_path, video_dir, stats)
+                changed.append((video_info['id'], file_path, stats.st_mtime, stats.st_size,
+                                json.dumps(video_info)))
+            
+            videos.append(video_info)
+        
+        # Persist only what changed: new/modified entries and removed files
+        if conn is not None:
+            try:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)', changed)
+                    conn.executemany('DELETE FROM videos WHERE path = ?', [(path,) for path in known])
+                    conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+                        ('video_dir', video_dir),
+                        ('version', _CACHE_VERSION),
+                        ('last_scan', str(time.time()))
+                    ])
+            except sqlite3.Error:
+                pass
+            finally:
+                conn.close()
+        
+        # Update cache
+        _set_cache(videos)
+        _video_cache['last_scan'] = time.time()
+
+def refresh_video_entries(file_paths, video_dir, allowed_extensions):
+    """
+    Update the cache for individual files that were created, modified or deleted.
+    
+    Args:
+        file_paths (iterable): Paths of the files that changed
+        video_dir (str): The base directory for videos
+        allowed_extensions (set): Set of allowed file extensions
+    """
+    with _scan_lock:
+        by_id = dict(_video_cache['by_id'])
+        changed = []
+        removed = []
+        
+        for file_path in file_paths:
+            file_ext = os.path.splitext(file_path)[1][1:].lower()
+            if file_ext not in allowed_extensions:
+                continue
+            
+            try:
+                stats = os.stat(file_path)
+            except OSError:
+                stats = None
+            
+            if stats is None or not os.path.isfile(file_path):
+                by_id.pop(generate_video_id(file_path), None)
+                removed.append((file_path,))
+                continue
+            
+            video_info = _build_video_info(file_path, video_dir, stats)
+            by_id[video_info['id']] = video_info
+            changed.append((video_info['id'], file_path, stats.st_mtime, stats.st_size,
+                            json.dumps(video_info)))
+        
+        if not changed and not removed:
+            return
+        
+        if _CACHE_FILE:
+            try:
+                conn = _connect_cache()
+                try:
+                    with conn:
+                        conn.executemany('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)', changed)
+                        conn.executemany('DELETE FROM videos WHERE path = ?', removed)
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass
+        
+        _set_cache(list(by_id.values()))
 
 def get_video_list(video_dir, allowed_extensions, sort_by='name', order='asc', force_rescan=False, scan_interval=3600):
     """
@@ -30,61 +304,61 @@ def get_video_list(video_dir, allowed_extensions, sort_by='name', order='asc', f
     Args:
         video_dir (str): The directory to scan for videos
         allowed_extensions (set): Set of allowed file extensions
-        sort_by (str): Field to sort by ('name', 'date', 'size')
+        sort_by (str): Field to sort by ('name', 'date', 'size'), or None for scan order
         order (str): Sort order ('asc' or 'desc')
         force_rescan (bool): Force a rescan even if cache is valid
         scan_interval (int): Time in seconds before rescanning
         
     Returns:
-        list: List of dictionaries with video information
+        list: List of dictionaries with video information. The list may be shared
+        with the cache and must not be modified by the caller.
     """
-    # Check if we need to rescan
-    if force_rescan or should_rescan(scan_interval) or not _video_cache['videos']:
-        videos = []
-        
-        # Walk through all files in the video directory
-        for root, _, files in os.walk(video_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_ext = os.path.splitext(file)[1][1:].lower()
-                
-                if file_ext in allowed_extensions:
-                    # Get file stats
-                    stats = os.stat(file_path)
-                    
-                    # Extract information
-                    video_id = generate_video_id(file_path)
-                    rel_path = os.path.relpath(file_path, video_dir)
-                    
-                    video_info = {
-                        'id': video_id,
-                        'name': os.path.splitext(os.path.basename(file))[0],
-                        'path': rel_path,
-                        'format': file_ext,
-                        'size': stats.st_size,
-                        'size_human': format_file_size(stats.st_size),
-                        'modified': datetime.fromtimestamp(stats.st_mtime).isoformat(),
-                        'created': datetime.fromtimestamp(stats.st_ctime).isoformat()
-                    }
-                    
-                    videos.append(video_info)
+    _ensure_cache(video_dir, allowed_extensions, force_rescan, scan_interval)
+    
+    if sort_by is None:
+        return _video_cache['videos']
+    
+    # Use the ordering precomputed at scan time
+    sorted_views = _video_cache['sorted']
+    if sort_by not in sorted_views:
+        sort_by = 'name'
+    sorted_videos = sorted_views.get(sort_by, [])
+    
+    if order.lower() == 'desc':
+        return sorted_videos[::-1]
+    return sorted_videos
+
+def get_video_by_id(video_id, video_dir, allowed_extensions):
+    """
+    Look up a single video by its ID without copying or sorting the catalog.
+    
+    Args:
+        video_id (str): The ID of the video to retrieve
+        video_dir (str): The base directory for videos
+        allowed_extensions (set): Set of allowed file extensions
         
-        # Update cache
-        _video_cache['videos'] = videos
-        _video_cache['last_scan'] = time.time()
+    Returns:
+        dict: Dictionary with video information or None if not found
+    """
+    _ensure_cache(video_dir, allowed_extensions)
     
-    # Get videos from cache and apply sorting
-    result = _video_cache['videos'].copy()
+    return _video_cache['by_id'].get(video_id)
+
+def get_library_stats(video_dir, allowed_extensions):
+    """
+    Get statistics about the video library, as maintained at scan time.
     
-    # Apply sorting
-    if sort_by == 'name':
-        result.sort(key=lambda x: x['name'].lower(), reverse=(order.lower() == 'desc'))
-    elif sort_by == 'date':
-        result.sort(key=lambda x: x['modified'], reverse=(order.lower() == 'desc'))
-    elif sort_by == 'size':
-        result.sort(key=lambda x: x['size'], reverse=(order.lower() == 'desc'))
+    Args:
+        video_dir (str): The base directory for videos
+        allowed_extensions (set): Set of allowed file extensions
+        
+    Returns:
+        dict: Dictionary with the total number of videos and the count per format
+    """
+    _ensure_cache(video_dir, allowed_extensions)
     
-    return result
+    # Published as a single dict, so the total and the per-format counts always match
+    return _video_cache['stats']
 
 def get_video_details(video_id, video_dir, allowed_extensions):
     """
@@ -98,22 +372,19 @@ def get_video_details(video_id, video_dir, allowed_extensions):
     Returns:
         dict: Dictionary with video details or None if not found
     """
-    videos = get_video_list(video_dir, allowed_extensions)
-    
-    # Find the video with the matching ID
-    for video in videos:
-        if video['id'] == video_id:
-            # Here you could add additional details like video duration, resolution, etc.
-            # This would require using a library like ffmpeg-python or pymediainfo
-            return video
-    
-    return None
+    # Here you could add additional details like video duration, resolution, etc.
+    # This would require using a library like ffmpeg-python or pymediainfo
+    return get_video_by_id(video_id, video_dir, allowed_extensions)
+
+# Units for format_file_size, indexed by the power of 1024
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
 
 def format_file_size(size_bytes):
     """Format file size in human-readable format."""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0 or unit == 'TB':
-            break
-        size_bytes /= 1024.0
+    if size_bytes <= 0:
+        return "0.00 B"
+    
+    # Every unit is 10 bits (1024x) bigger than the previous one
+    unit = min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
     
-    return f"{size_bytes:.2f} {unit}"
+    return f"{size_bytes / (1 << (unit * 10)):.2f} {_SIZE_UNITS[unit]}"
@@ -0,0 +1,205 @@
+"""
+Background scanning of the video directory.
+
+Keeps the video cache fresh outside of the request path, so requests only
+ever read the in-memory catalog.
+Missing thumbnails are generated by a small pool of worker threads after each
+scan, so browsing the library rarely has to wait for a thumbnail. With PyAV the
+frames are decoded inside this process, otherwise each one runs ffmpeg.
+
+Note: watching the directory for changes requires the optional watchdog
+dependency. Without it the cache is refreshed on SCAN_INTERVAL only.
+"""
+import os
+import time
+import queue
+import threading
+
+from utils.file_scanner import get_video_list, refresh_video_entries, set_background_scan, should_rescan
+from utils.video_helper import generate_thumbnail, check_dependencies
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+# Seconds to wait after a filesystem event so bursts (e.g. a file being copied) are handled together
+SETTLE_DELAY = 2
+
+# Changes reported by the watcher, consumed by the scanner loop
+_pending = {
+    'paths': set(),
+    'full_rescan': False
+}
+_pending_lock = threading.Lock()
+_wakeup = threading.Event()
+
+# Thumbnails waiting to be generated, as (video_id, video_path, thumbnail_path) tuples
+_thumbnail_queue = queue.Queue()
+
+# IDs of videos whose thumbnail is queued/in progress, or failed since the last full scan
+_thumbnail_jobs = set()
+_thumbnail_failed = set()
+_thumbnail_lock = threading.Lock()
+
+def _queue_change(paths=(), full_rescan=False):
+    """Record a filesystem change and wake up the scanner loop."""
+    with _pending_lock:
+        _pending['paths'].update(paths)
+        _pending['full_rescan'] = _pending['full_rescan'] or full_rescan
+    _wakeup.set()
+
+def _take_changes():
+    """Return and clear the changes recorded since the last call."""
+    with _pending_lock:
+        paths = _pending['paths']
+        full_rescan = _pending['full_rescan']
+        _pending['paths'] = set()
+        _pending['full_rescan'] = False
+    return paths, full_rescan
+
+def _thumbnail_worker(app):
+    """Generate queued thumbnails one at a time (each worker decodes with a single thread)."""
+    width = app.config.get('THUMBNAIL_WIDTH', 320)
+    
+    while True:
+        video_id, video_path, thumbnail_path = _thumbnail_queue.get()
+        try:
+            with app.app_context():
+                success = generate_thumbnail(video_path, thumbnail_path, time_offset=10, width=width)
+        except Exception as e:
+            app.logger.error(f"Error generating thumbnail for {video_path}: {str(e)}")
+            success = False
+        
+        with _thumbnail_lock:
+            _thumbnail_jobs.discard(video_id)
+            if not success:
+                _thumbnail_failed.add(video_id)
+
+def _queue_missing_thumbnails(app):
+    """Queue thumbnail generation for every video that doesn't have one yet."""
+    video_dir = app.config['VIDEO_DIRECTORY']
+    thumbnail_dir = app.config['THUMBNAIL_DIRECTORY']
+    
+    # One directory listing instead of a stat per video
+    try:
+        existing = set(os.listdir(thumbnail_dir))
+    except OSError:
+        existing = set()
+    
+    for video in get_video_list(video_dir, app.config['ALLOWED_EXTENSIONS'], sort_by=None):
+        if f"{video['id']}.jpg" in existing:
+            continue
+        
+        with _thumbnail_lock:
+            if video['id'] in _thumbnail_jobs or video['id'] in _thumbnail_failed:
+                continue
+            _thumbnail_jobs.add(video['id'])
+        
+        _thumbnail_queue.put((
+            video['id'],
+            os.path.join(video_dir, video['path']),
+            os.path.join(thumbnail_dir, f"{video['id']}.jpg")
+        ))
+
+def _loop(app, generate_thumbnails=False):
+    """Refresh the video cache on a timer and whenever the watcher reports changes."""
+    video_dir = app.config['VIDEO_DIRECTORY']
+    allowed_extensions = app.config['ALLOWED_EXTENSIONS']
+    scan_interval = app.config['SCAN_INTERVAL']
+    
+    # Initial scan, unless the persisted cache is still fresh. Requests don't check
+    # staleness while the background scanner runs, so it has to be forced here
+    try:
+        get_video_list(video_dir, allowed_extensions, sort_by=None,
+                       force_rescan=should_rescan(scan_interval))
+    except Exception as e:
+        app.logger.error(f"Error during initial video scan: {str(e)}")
+    
+    while True:
+        if generate_thumbnails:
+            try:
+                _queue_missing_thumbnails(app)
+            except Exception as e:
+                app.logger.error(f"Error queueing thumbnails: {str(e)}")
+        
+        if _wakeup.wait(scan_interval):
+            time.sleep(SETTLE_DELAY)
+            _wakeup.clear()
+            paths, full_rescan = _take_changes()
+        else:
+            # Scheduled rescan, also give previously failed thumbnails another chance
+            paths, full_rescan = set(), True
+            with _thumbnail_lock:
+                _thumbnail_failed.clear()
+        
+        try:
+            if full_rescan:
+                get_video_list(video_dir, allowed_extensions, sort_by=None, force_rescan=True)
+            elif paths:
+                refresh_video_entries(paths, video_dir, allowed_extensions)
+        except Exception as e:
+            app.logger.error(f"Error refreshing video list: {str(e)}")
+
+def _start_watcher(app):
+    """Watch the video directory and queue changed files for the scanner loop."""
+    class VideoEventHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.event_type in ('opened', 'closed_no_write'):
+                return
+            
+            # Directories created/moved/deleted as a whole can affect many files, rescan everything
+            if event.is_directory:
+                if event.event_type in ('created', 'moved', 'deleted'):
+                    _queue_change(full_rescan=True)
+                return
+            
+            paths = [event.src_path]
+            if getattr(event, 'dest_path', None):
+                paths.append(event.dest_path)
+            _queue_change(paths)
+    
+    observer = Observer()
+    observer.schedule(VideoEventHandler(), app.config['VIDEO_DIRECTORY'], recursive=True)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+def start_scanner(app):
+    """
+    Start the background scanner thread (and file watcher and thumbnail workers,
+    if available) for an app.
+    
+    The scanner state is per process and the threads share one SQLite cache file,
+    so this should run in a single process only (see BACKGROUND_SCAN).
+    
+    Args:
+        app (Flask): The application whose configuration describes the video library
+    """
+    set_background_scan(True)
+    
+    generate_thumbnails = False
+    if app.config.get('GENERATE_THUMBNAILS', True):
+        with app.app_context():
+            generate_thumbnails = check_dependencies()
+    
+    if generate_thumbnails:
+        for i in range(max(1, app.config.get('THUMBNAIL_WORKERS', 1))):
+            threading.Thread(
+                target=_thumbnail_worker, args=(app,), name=f'localflix-thumbnails-{i}', daemon=True
+            ).start()
+    
+    thread = threading.Thread(target=_loop, args=(app, generate_thumbnails), name='localflix-scanner', daemon=True)
+    thread.start()
+    app.extensions['scanner_thread'] = thread
+    
+    if app.config.get('WATCH_VIDEO_DIRECTORY', True):
+        if not WATCHDOG_AVAILABLE:
+            app.logger.warning("watchdog is not installed. New videos will appear after the next scheduled scan.")
+        else:
+            try:
+                app.extensions['video_watcher'] = _start_watcher(app)
+            except OSError as e:
+                app.logger.error(f"Error watching video directory: {str(e)}")
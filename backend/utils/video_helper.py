@@ -4,6 +4,7 @@ Utilities for video metadata extraction and thumbnail generation.
 Note: This module requires additional dependencies:
 - ffmpeg-python for video processing
 - Pillow for image manipulation
+- PyAV (optional) to extract thumbnail frames in-process instead of running ffmpeg
 """
 import os
 import tempfile
@@ -23,6 +24,12 @@ try:
 except ImportError:
     PILLOW_AVAILABLE = False
 
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
 def check_dependencies():
     """Check if the required dependencies are installed."""
     if not FFMPEG_AVAILABLE:
@@ -31,6 +38,10 @@ def check_dependencies():
     if not PILLOW_AVAILABLE:
         current_app.logger.warning("Pillow is not installed. Thumbnail processing will be limited.")
     
+    # PyAV decodes frames in-process, so thumbnails don't need the ffmpeg command
+    if AV_AVAILABLE and PILLOW_AVAILABLE:
+        return True
+    
     # Check if ffmpeg is installed on the system
     try:
         subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
@@ -97,6 +108,33 @@ def get_video_metadata(video_path):
         current_app.logger.error(f"Error extracting metadata from {video_path}: {str(e)}")
         return {}
 
+def extract_frame(video_path, time_offset=10):
+    """
+    Decode a single video frame in-process using PyAV.
+    
+    Args:
+        video_path (str): Path to the video file
+        time_offset (int): Time in seconds from the start of the video
+        
+    Returns:
+        PIL.Image.Image: The keyframe at or before time_offset, or None if no frame could be decoded
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        
+        # One decoder thread, like ffmpeg's -threads 1: several thumbnail workers run at
+        # once inside the server process. Only keyframes are needed after the seek
+        stream.thread_count = 1
+        stream.codec_context.skip_frame = 'NONKEY'
+        
+        # Seek to the nearest keyframe before the offset (in av.time_base units)
+        container.seek(int(time_offset * av.time_base), backward=True)
+        
+        for frame in container.decode(stream):
+            return frame.to_image()
+    
+    return None
+
 def generate_thumbnail(video_path, output_path, time_offset=10, width=320):
     """
     Generate a thumbnail from a video file.
@@ -114,57 +152,70 @@ def generate_thumbnail(video_path, output_path, time_offset=10, width=320):
         return False
     
     # Ensure the output directory exists
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
     
+    temp_path = None
     try:
-        # Temporary file for the extracted frame
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        # Use ffmpeg to extract a frame from the video
-        subprocess.run([
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', str(time_offset),
-            '-frames:v', '1',
-            '-q:v', '2',
-            temp_path
-        ], check=True, capture_output=True)
+        # Temporary file next to the output, so it can be moved into place atomically
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg', dir=output_dir)
+        os.close(temp_fd)
+        
+        if AV_AVAILABLE and PILLOW_AVAILABLE:
+            # Decode the frame in-process, avoiding an ffmpeg fork/exec per thumbnail
+            img = extract_frame(video_path, time_offset)
+            if img is None:
+                raise RuntimeError(f"no frame found at {time_offset}s")
+        else:
+            # Use ffmpeg to extract a frame from the video. Seeking before -i jumps to the
+            # nearest keyframe instead of decoding everything up to time_offset
+            subprocess.run([
+                'ffmpeg',
+                '-ss', str(time_offset),
+                '-i', video_path,
+                '-frames:v', '1',
+                '-q:v', '2',
+                '-an', '-sn',
+                '-threads', '1',
+                '-y',
+                temp_path
+            ], check=True, capture_output=True)
+            
+            # ffmpeg exits successfully without writing a frame if the offset is past the end
+            if os.path.getsize(temp_path) == 0:
+                raise RuntimeError(f"no frame found at {time_offset}s")
+            
+            img = Image.open(temp_path) if PILLOW_AVAILABLE else None
         
         # Resize the thumbnail if Pillow is available
-        if PILLOW_AVAILABLE:
-            with Image.open(temp_path) as img:
+        if img is not None:
+            with img:
                 # Calculate height to maintain aspect ratio
                 width_percent = width / float(img.size[0])
                 height = int(float(img.size[1]) * width_percent)
                 
                 # Resize the image
                 img_resized = img.resize((width, height), Image.LANCZOS)
-                img_resized.save(output_path, 'JPEG', quality=90)
-        else:
-            # If Pillow is not available, just copy the extracted frame
-            os.rename(temp_path, output_path)
-        
-        # Clean up the temporary file if it still exists
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+            img_resized.save(temp_path, 'JPEG', quality=90)
         
+        # mkstemp creates the file as 0600, give it the usual permissions before moving it into place
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, output_path)
         return True
     
     except Exception as e:
         current_app.logger.error(f"Error generating thumbnail for {video_path}: {str(e)}")
         
         # Clean up any temporary files
-        if 'temp_path' in locals() and os.path.exists(temp_path):
+        if temp_path and os.path.exists(temp_path):
             os.unlink(temp_path)
         
         return False
 
 def format_duration(seconds):
     """Format duration in seconds to HH:MM:SS format."""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    seconds = int(seconds % 60)
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
     
     if hours > 0:
         return f"{hours:02d}:{minutes:02d}:{seconds:02d}"